@@ -4,296 +4,484 @@ Neon Database Verification Script
 Checks connection, schema, and functionality
 """
 
+import argparse
+import logging
 import os
 import sys
-import psycopg2
-from dotenv import load_dotenv
+import time
+from functools import lru_cache
 from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
 
 # Add parent directory to path for imports
 sys.path.append(str(Path(__file__).parent.parent))
 
-load_dotenv()
+log = logging.getLogger(__name__)
+
+# libpq connection options: fail fast on an unreachable host, keep the
+# session alive through the Neon proxy and tag it in pg_stat_activity
+CONN_KWARGS = dict(
+    connect_timeout=5,
+    keepalives=1,
+    keepalives_idle=30,
+    keepalives_interval=10,
+    keepalives_count=3,
+    application_name='verify_neon',
+)
+
+# pg_class.relkind values listed by the schema check
+RELKIND_LABELS = {
+    'r': 'BASE TABLE',
+    'p': 'PARTITIONED TABLE',
+    'v': 'VIEW',
+    'm': 'MATERIALIZED VIEW',
+    'f': 'FOREIGN TABLE',
+}
+
+
+def _bootstrap():
+    """Load environment variables from .env before anything reads them"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    # A repeated run in the same process must see the reloaded environment
+    _neon_url.cache_clear()
+
+
+@lru_cache(maxsize=1)
+def _neon_url():
+    """Resolve the database URL from the environment"""
+    url = os.environ.get('NEON_DATABASE_URL') or os.environ.get('DATABASE_URL')
+    if not url:
+        raise RuntimeError("No database URL found in environment")
+    return url
+
+
+def mask_password(url):
+    """Return the database URL with its password masked for display"""
+    try:
+        parts = urlsplit(url)
+        password = parts.password
+    except ValueError:
+        # Malformed URL (e.g. unbalanced IPv6 brackets): show nothing of it
+        return "<unparseable database URL>"
 
+    if not password:
+        return url
 
-def test_connection():
-    """Test basic database connection"""
-    print("🔌 Testing database connection...")
+    # Keep the host part verbatim so IPv6 brackets and ports survive
+    host = parts.netloc.rpartition('@')[2]
+    return urlunsplit(parts._replace(netloc=f"{parts.username}:***@{host}"))
 
-    neon_url = os.environ.get('NEON_DATABASE_URL') or os.environ.get('DATABASE_URL')
 
-    if not neon_url:
-        print("❌ No database URL found in environment")
-        return False
+class BufferedHandler(logging.StreamHandler):
+    """Collects formatted records and writes them in one call on flush()"""
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.lines = []
+
+    def emit(self, record):
+        try:
+            self.lines.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.lines:
+                self.stream.write("\n".join(self.lines) + "\n")
+                self.lines.clear()
+            super().flush()
+        finally:
+            self.release()
+
+
+def _output_handler():
+    """Return the handler installed by configure_logging(), if any"""
+    for handler in log.handlers:
+        if isinstance(handler, BufferedHandler):
+            return handler
+    return None
+
+
+def configure_logging(level):
+    """Log to stdout, buffering records until flush_output() is called
+
+    main() calls this itself. Code that imports the module and runs the
+    tests directly must call it first (and flush_output() afterwards);
+    otherwise records fall through to logging's last-resort handler,
+    which shows only warnings and errors.
+    """
+    handler = _output_handler()
+    if handler is None:
+        handler = BufferedHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        log.addHandler(handler)
+    else:
+        # Repeated runs in one process: pick up the current stdout
+        handler.setStream(sys.stdout)
+
+    log.setLevel(level)
+    log.propagate = False
+
+
+def flush_output():
+    """Write out all buffered log records"""
+    handler = _output_handler()
+    if handler is not None:
+        handler.flush()
+
+
+def _parse_level(name):
+    """Return the logging level for a level name, or None if unknown"""
+    level = logging.getLevelName(name.strip().upper())
+    return level if isinstance(level, int) else None
+
+
+def _log(level, prefix, msg, args, newline):
+    """Log msg with its level prefix, after a blank line if newline is set"""
+    log.log(level, ("\n" if newline else "") + prefix + msg, *args)
+
 
-    # Mask password in URL for display
-    display_url = neon_url
-    if '@' in display_url:
-        parts = display_url.split('@')
-        if ':' in parts[0]:
-            user_pass = parts[0].split('://')[-1]
-            if ':' in user_pass:
-                user = user_pass.split(':')[0]
-                display_url = display_url.replace(user_pass, f"{user}:***")
+def _info(msg, *args, newline=False):
+    _log(logging.INFO, "", msg, args, newline)
 
-    print(f"📡 Connecting to: {display_url}")
+
+def _ok(msg, *args, newline=False):
+    _log(logging.INFO, "✅ ", msg, args, newline)
+
+
+def _fail(msg, *args, newline=False):
+    _log(logging.ERROR, "❌ ", msg, args, newline)
+
+
+def _warn(msg, *args, newline=False):
+    _log(logging.WARNING, "⚠️  ", msg, args, newline)
+
+
+def _fetchrow(cursor, sql, params=None):
+    """Run a query expected to return exactly one row and return that row"""
+    cursor.execute(sql, params)
+    row = cursor.fetchone()
+    if row is None:
+        raise RuntimeError("Query returned no rows")
+    return row
+
+
+def open_connection():
+    """Open the database connection shared by the database tests"""
+    import psycopg2
+
+    _info("🔌 Opening database connection...")
 
     try:
-        conn = psycopg2.connect(neon_url)
-        cursor = conn.cursor()
-
-        # Test basic query
-        cursor.execute('SELECT version()')
-        version = cursor.fetchone()[0]
-
-        # Get connection info
-        cursor.execute("""
-            SELECT
-                current_database() as database,
-                current_user as user,
-                inet_server_addr() as server_addr,
-                inet_server_port() as server_port
-        """)
-        conn_info = cursor.fetchone()
-
-        cursor.close()
-        conn.close()
-
-        print("✅ Connection successful!")
-        print(f"   Database: {conn_info[0]}")
-        print(f"   User: {conn_info[1]}")
-        print(f"   Server: {conn_info[2]}:{conn_info[3]}")
-        print(f"   Version: {version.split(',')[0]}")
+        neon_url = _neon_url()
+    except RuntimeError as e:
+        _fail("%s", e)
+        return None
 
-        return True
+    _info("📡 Connecting to: %s", mask_password(neon_url))
+
+    try:
+        conn = psycopg2.connect(neon_url, **CONN_KWARGS)
+        # Autocommit keeps a failed query in one test from aborting the
+        # transaction for the tests that follow on the same connection
+        conn.autocommit = True
+        return conn
 
     except psycopg2.Error as e:
-        print(f"❌ Connection failed: {e}")
-        return False
+        _fail("Connection failed: %s", e)
+        return None
     except Exception as e:
-        print(f"❌ Unexpected error: {e}")
-        return False
+        _fail("Unexpected error: %s", e)
+        return None
 
 
-def test_extensions():
-    """Test required PostgreSQL extensions"""
-    print("\n🧩 Testing PostgreSQL extensions...")
+def test_connection(conn):
+    """Test basic database connection"""
+    import psycopg2
 
-    neon_url = os.environ.get('NEON_DATABASE_URL') or os.environ.get('DATABASE_URL')
+    log.debug("🔌 Testing database connection...")
 
     try:
-        conn = psycopg2.connect(neon_url)
-        cursor = conn.cursor()
+        with conn.cursor() as cursor:
+            # Test basic query and get connection info in one round-trip
+            database, user, server_addr, server_port, version = _fetchrow(cursor, """
+                SELECT
+                    current_database() as database,
+                    current_user as user,
+                    inet_server_addr() as server_addr,
+                    inet_server_port() as server_port,
+                    version() as version
+            """)
+
+        _ok("Connection successful!")
+        _info("   Database: %s", database)
+        _info("   User: %s", user)
+        _info("   Server: %s:%s", server_addr, server_port)
+        _info("   Version: %s", version.split(',')[0])
 
-        # Check for required extensions
-        extensions = ['vector', 'uuid-ossp']
+        return True
 
-        for ext in extensions:
-            cursor.execute("""
-                SELECT EXISTS(
-                    SELECT 1 FROM pg_extension WHERE extname = %s
-                )
-            """, (ext,))
-
-            exists = cursor.fetchone()[0]
-            if exists:
-                print(f"✅ {ext}: Available")
-            else:
-                print(f"❌ {ext}: Not found")
+    except psycopg2.Error as e:
+        _fail("Connection failed: %s", e)
+        return False
+    except Exception as e:
+        _fail("Unexpected error: %s", e)
+        return False
 
-        # Test vector operations
-        print("\n🧮 Testing vector operations...")
-        try:
-            cursor.execute("SELECT '[1,2,3]'::vector <-> '[1,2,4]'::vector as distance")
-            distance = cursor.fetchone()[0]
-            print(f"✅ Vector distance calculation: {distance}")
 
-            cursor.execute("SELECT '[1,0,0]'::vector <=> '[0,1,0]'::vector as cosine_distance")
-            cosine_dist = cursor.fetchone()[0]
-            print(f"✅ Cosine distance calculation: {cosine_dist}")
+def test_extensions(conn):
+    """Test required PostgreSQL extensions"""
+    log.debug("🧩 Testing PostgreSQL extensions...")
+
+    try:
+        with conn.cursor() as cursor:
+            # Check for required extensions
+            has_vector, has_uuid = _fetchrow(cursor, """
+                SELECT
+                    bool_or(extname = 'vector') as has_vector,
+                    bool_or(extname = 'uuid-ossp') as has_uuid
+                FROM pg_extension
+            """)
+
+            for ext, exists in (('vector', has_vector), ('uuid-ossp', has_uuid)):
+                if exists:
+                    _ok("%s: Available", ext)
+                else:
+                    _fail("%s: Not found", ext)
+
+            # Test vector operations
+            _info("🧮 Testing vector operations...", newline=True)
+            try:
+                distance, cosine_dist = _fetchrow(cursor, """
+                    SELECT
+                        '[1,2,3]'::vector <-> '[1,2,4]'::vector as distance,
+                        '[1,0,0]'::vector <=> '[0,1,0]'::vector as cosine_distance
+                """)
+                _ok("Vector distance calculation: %s", distance)
+                _ok("Cosine distance calculation: %s", cosine_dist)
 
-        except Exception as e:
-            print(f"❌ Vector operations failed: {e}")
+            except Exception as e:
+                _fail("Vector operations failed: %s", e)
 
-        cursor.close()
-        conn.close()
         return True
 
     except Exception as e:
-        print(f"❌ Extension test failed: {e}")
+        _fail("Extension test failed: %s", e)
         return False
 
 
-def test_schema():
+def test_schema(conn):
     """Test database schema and tables"""
-    print("\n📊 Testing database schema...")
-
-    neon_url = os.environ.get('NEON_DATABASE_URL') or os.environ.get('DATABASE_URL')
+    log.debug("📊 Testing database schema...")
 
     try:
-        conn = psycopg2.connect(neon_url)
-        cursor = conn.cursor()
-
-        # Get all tables
-        cursor.execute("""
-            SELECT table_name, table_type
-            FROM information_schema.tables
-            WHERE table_schema = 'public'
-            ORDER BY table_name
-        """)
+        with conn.cursor() as cursor:
+            # Get all tables straight from the catalog; information_schema
+            # views add joins and privilege filters we don't need here
+            cursor.execute("""
+                SELECT c.relname, c.relkind
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public'
+                  AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+                ORDER BY c.relname
+            """)
 
-        tables = cursor.fetchall()
+            tables = cursor.fetchall()
 
         if not tables:
-            print("⚠️  No tables found in public schema")
-            print("   Run 'python scripts/migrate_to_neon.py' to apply schema")
+            _warn(
+                "No tables found in public schema\n"
+                "   Run 'python scripts/migrate_to_neon.py' to apply schema"
+            )
             return False
 
-        print(f"✅ Found {len(tables)} tables:")
-        for table_name, table_type in tables:
-            print(f"   📋 {table_name} ({table_type})")
+        _ok("Found %d tables:", len(tables))
+        for table_name, relkind in tables:
+            _info("   📋 %s (%s)", table_name, RELKIND_LABELS[relkind])
 
         # Test specific tables that should exist
         expected_tables = ['users', 'invoices', 'companies', 'processing_jobs']
+        present_tables = {table_name for table_name, _ in tables}
         missing_tables = []
 
         for table in expected_tables:
-            cursor.execute("""
-                SELECT EXISTS (
-                    SELECT 1 FROM information_schema.tables
-                    WHERE table_schema = 'public'
-                      AND table_name = %s
-                )
-            """, (table,))
-
-            exists = cursor.fetchone()[0]
-            if exists:
-                print(f"✅ Core table '{table}': Present")
+            if table in present_tables:
+                _ok("Core table '%s': Present", table)
             else:
-                print(f"❌ Core table '{table}': Missing")
+                _fail("Core table '%s': Missing", table)
                 missing_tables.append(table)
 
         if missing_tables:
-            print(f"\n⚠️  Missing tables: {', '.join(missing_tables)}")
-            print("   Schema may be incomplete or not applied")
+            _warn(
+                "Missing tables: %s\n"
+                "   Schema may be incomplete or not applied",
+                ', '.join(missing_tables),
+                newline=True,
+            )
 
-        cursor.close()
-        conn.close()
         return len(missing_tables) == 0
 
     except Exception as e:
-        print(f"❌ Schema test failed: {e}")
+        _fail("Schema test failed: %s", e)
         return False
 
 
-def test_performance():
+def test_performance(conn):
     """Test basic database performance"""
-    print("\n⚡ Testing database performance...")
-
-    neon_url = os.environ.get('NEON_DATABASE_URL') or os.environ.get('DATABASE_URL')
+    log.debug("⚡ Testing database performance...")
 
     try:
-        conn = psycopg2.connect(neon_url)
-        cursor = conn.cursor()
-
-        import time
-
-        # Test simple query performance
-        start_time = time.time()
-        cursor.execute("SELECT COUNT(*) FROM information_schema.tables")
-        result = cursor.fetchone()[0]
-        query_time = (time.time() - start_time) * 1000
-
-        print(f"✅ Simple query: {query_time:.2f}ms ({result} tables)")
-
-        # Test connection pool settings
-        cursor.execute("SHOW max_connections")
-        max_conn = cursor.fetchone()[0]
-        print(f"✅ Max connections: {max_conn}")
-
-        # Check current connections
-        cursor.execute("""
-            SELECT COUNT(*)
-            FROM pg_stat_activity
-            WHERE state = 'active'
-        """)
-        active_conn = cursor.fetchone()[0]
-        print(f"✅ Active connections: {active_conn}")
-
-        cursor.close()
-        conn.close()
+        with conn.cursor() as cursor:
+            # Test simple query performance; only this query is timed.
+            # Counts the same public relations the schema check lists
+            start_ns = time.perf_counter_ns()
+            result, = _fetchrow(cursor, """
+                SELECT COUNT(*)
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'public'
+                  AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+            """)
+            query_ns = time.perf_counter_ns() - start_ns
+
+            _ok("Simple query: %.2fms (%s tables)", query_ns / 1e6, result)
+
+            # Check connection pool settings and current connections
+            max_conn, active_conn = _fetchrow(cursor, """
+                SELECT
+                    current_setting('max_connections') as max_connections,
+                    (SELECT COUNT(*) FROM pg_stat_activity WHERE state = 'active') as active_connections
+            """)
+            _ok("Max connections: %s", max_conn)
+            _ok("Active connections: %s", active_conn)
+
         return True
 
     except Exception as e:
-        print(f"❌ Performance test failed: {e}")
+        _fail("Performance test failed: %s", e)
         return False
 
 
+@lru_cache(maxsize=1)
+def _get_app():
+    """Create the Flask app once per process"""
+    from app import create_app
+
+    return create_app()
+
+
 def test_flask_integration():
     """Test Flask app database integration"""
-    print("\n🌶️  Testing Flask integration...")
+    log.debug("🌶️  Testing Flask integration...")
 
     try:
         # Try to import and configure Flask app
-        from app import create_app, db
+        from app import db
 
-        app = create_app()
+        app = _get_app()
         with app.app_context():
             # Test SQLAlchemy connection
             result = db.session.execute(db.text('SELECT 1 as test')).fetchone()
             if result and result[0] == 1:
-                print("✅ SQLAlchemy connection: Working")
+                _ok("SQLAlchemy connection: Working")
             else:
-                print("❌ SQLAlchemy connection: Failed")
+                _fail("SQLAlchemy connection: Failed")
 
             # Check if models can be imported
             try:
                 from app.models import Invoice, Company, User
-                print("✅ Model imports: Working")
+                _ok("Model imports: Working")
             except ImportError as e:
-                print(f"❌ Model imports failed: {e}")
+                _fail("Model imports failed: %s", e)
 
             # Test database URL detection
             db_url = str(db.engine.url)
             if 'neon.tech' in db_url:
-                print("✅ Neon database detected")
+                _ok("Neon database detected")
             else:
-                print("⚠️  Not using Neon database")
+                _warn("Not using Neon database")
 
         return True
 
     except ImportError:
-        print("⚠️  Flask app not available (run from backend/api directory)")
+        _warn("Flask app not available (run from backend/api directory)")
         return None
     except Exception as e:
-        print(f"❌ Flask integration test failed: {e}")
+        _fail("Flask integration test failed: %s", e)
         return False
 
 
-def main():
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(
+        description="Verify the Neon database connection, schema and functionality"
+    )
+    parser.add_argument(
+        '-q', '--quiet', action='store_true',
+        help="only report warnings and failures",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """Main verification process"""
-    print("=" * 60)
-    print("🔍 NEON DATABASE VERIFICATION")
-    print("=" * 60)
+    args = parse_args(argv)
+    _bootstrap()
+
+    level_name = os.environ.get('VERIFY_LOG', 'INFO')
+    level = logging.WARNING if args.quiet else _parse_level(level_name)
+    configure_logging(logging.INFO if level is None else level)
+    if level is None:
+        _warn("Unknown VERIFY_LOG level %r, using INFO", level_name)
+
+    _info("=" * 60)
+    _info("🔍 NEON DATABASE VERIFICATION")
+    _info("=" * 60)
 
-    tests = [
+    db_tests = [
         ("Connection", test_connection),
         ("Extensions", test_extensions),
         ("Schema", test_schema),
         ("Performance", test_performance),
-        ("Flask Integration", test_flask_integration),
     ]
 
+    # One connection for all database tests, run sequentially. A thread per
+    # test with its own connection would finish sooner, but it would hold
+    # four sessions on a small Neon compute whose max_connections the app's
+    # pool also draws on, and those sessions would inflate the active
+    # connection count the performance test reports
+    conn = open_connection()
+    flush_output()
+
     results = []
-    for test_name, test_func in tests:
-        print(f"\n{'='*20} {test_name} {'='*20}")
-        result = test_func()
-        results.append((test_name, result))
+    try:
+        for test_name, test_func in db_tests:
+            _info("%s %s %s", "=" * 20, test_name, "=" * 20, newline=True)
+            if conn is None:
+                # Without a connection only the connection test counts as failed
+                _warn("No database connection available")
+                result = False if test_func is test_connection else None
+            else:
+                result = test_func(conn)
+            results.append((test_name, result))
+            flush_output()
+    finally:
+        if conn is not None:
+            conn.close()
+
+    _info("%s Flask Integration %s", "=" * 20, "=" * 20, newline=True)
+    results.append(("Flask Integration", test_flask_integration()))
+    flush_output()
 
     # Summary
-    print("\n" + "="*60)
-    print("📋 VERIFICATION SUMMARY")
-    print("="*60)
+    _info("=" * 60, newline=True)
+    _info("📋 VERIFICATION SUMMARY")
+    _info("=" * 60)
 
     passed = 0
     failed = 0
@@ -301,22 +489,23 @@ def main():
 
     for test_name, result in results:
         if result is True:
-            print(f"✅ {test_name}: PASSED")
+            _ok("%s: PASSED", test_name)
             passed += 1
         elif result is False:
-            print(f"❌ {test_name}: FAILED")
+            _fail("%s: FAILED", test_name)
             failed += 1
         else:
-            print(f"⚠️  {test_name}: SKIPPED")
+            _warn("%s: SKIPPED", test_name)
             skipped += 1
 
-    print(f"\nResults: {passed} passed, {failed} failed, {skipped} skipped")
+    _info("Results: %d passed, %d failed, %d skipped", passed, failed, skipped, newline=True)
 
     if failed == 0:
-        print("\n🎉 All tests passed! Your Neon database is ready.")
+        _info("🎉 All tests passed! Your Neon database is ready.", newline=True)
     else:
-        print(f"\n💥 {failed} test(s) failed. Check the issues above.")
+        _fail("%d test(s) failed. Check the issues above.", failed, newline=True)
 
+    flush_output()
     return failed == 0
 
 